@@ -7,6 +7,7 @@ Tested with Tensorflow 2.1rc0.
 # TODO: what is the default weight regularizer?
 
 import os
+import time
 import argparse
 import shutil
 import json
@@ -38,17 +39,29 @@ def train(args):
   train_summary_writer = tf.summary.create_file_writer(
       os.path.join(log_path, 'train'))
 
+  # Data parallelism on all devices
+  strategy = tf.distribute.MirroredStrategy()
+  replicas = strategy.num_replicas_in_sync
+
   # Define datasets
-  image_shape = (300, 300, 3)
+  image_shape = (256, 256, 3)
   train_dataset, train_size = data.load_pair(*args.datasets, 'all',
       shape=image_shape, batch=args.batch)
 
-  train_dataset_it = iter(train_dataset)
+  # Batch size is fixed, because of drop_remainder. Split among replicas
+  batch_size = train_dataset.element_spec[0].shape[0]
+  if batch_size % replicas != 0:
+    raise ValueError('Batch size ' + str(batch_size) +
+        ' is not divisible by the number of replicas ' + str(replicas))
+
+  train_dataset_it = iter(strategy.experimental_distribute_dataset(
+      train_dataset))
   few_samples = [data.load_few(name, 'all', image_shape, 1) \
       for name in args.datasets]
 
-  # Define keras model
-  keras_model, model_layer = models.define_model(image_shape)
+  # Define keras model (inputs are split among replicas in the scope)
+  with strategy.scope():
+    keras_model, model_layer = models.define_model(image_shape, batch_size)
 
   # Save keras model
   keras_json = keras_model.to_json()
@@ -62,13 +75,14 @@ def train(args):
     return model_layer(inputs)
 
   tf.summary.trace_on()
-  tracing_model_ops(next(train_dataset_it))
+  tracing_model_ops(few_samples)
   with train_summary_writer.as_default():
     tf.summary.trace_export('Model', step=0)
 
   # Resuming
+  saver = CheckpointSaver(keras_model, model_checkpoint)
   if args.cont:
-    keras_model.load_weights(model_checkpoint)
+    saver.load()
     print('> Weights loaded')
 
   # Training steps
@@ -80,9 +94,17 @@ def train(args):
 
   # Training tools
   make_optmizer = lambda: tf.optimizers.Adam(args.rate)
-  trainer = models.Trainer(keras_model, make_optmizer, train_dataset_it)
-  tester = models.Tester(keras_model, train_dataset_it)
-  saver = CheckpointSaver(keras_model, model_checkpoint)
+  with strategy.scope():
+    trainer = models.Trainer(keras_model, make_optmizer, strategy)
+    tester = models.Tester(keras_model, strategy)
+
+  # Timings: waiting for input and the whole step (seconds since last log)
+  timings = {'input_time': 0.0, 'step_time': 0.0}
+  timed_steps = 0
+
+  # Profile some steps, skipping the first (tracing and compilation)
+  profiled_steps = range(step_saver.step + 1,
+      step_saver.step + 1 + args.profile)
 
   # Print job
   print('> Training.  Epochs:', epochs)
@@ -94,16 +116,42 @@ def train(args):
     for epoch_step in range(steps_per_epoch):
       print('> Step', step_saver.step, end='\r')
 
+      # Profiling
+      if profiled_steps and step_saver.step == profiled_steps[0]:
+        tf.profiler.experimental.start(log_path)
+
       # Train step
-      output = trainer.step()
+      with tf.profiler.experimental.Trace('train', step_num=step_saver.step,
+          _r=1):
+        start_time = time.perf_counter()
+        inputs = next(train_dataset_it)
+        input_time = time.perf_counter()
+        output = trainer.step(inputs)
+        end_time = time.perf_counter()
+
+      timings['input_time'] += input_time - start_time
+      timings['step_time'] += end_time - start_time
+      timed_steps += 1
+
+      if profiled_steps and step_saver.step == profiled_steps[-1]:
+        tf.profiler.experimental.stop()
 
       # Validation and log
       if step_saver.step % args.logs == 0 or epoch_step == steps_per_epoch-1:
         print('\n> Validation')
 
+        # Timings
+        timings = {name: timings[name] / timed_steps for name in timings}
+        print('  Timings:', timings)
+        with train_summary_writer.as_default():
+          for name in timings:
+            tf.summary.scalar(name, timings[name], step=step_saver.step)
+        timings = {name: 0.0 for name in timings}
+        timed_steps = 0
+
         # Evaluation
         for i in range(args.val_steps):
-          tester.step()
+          tester.step(next(train_dataset_it))
         train_metrics = tester.result()
 
         # Log in console
@@ -125,7 +173,7 @@ def train(args):
 
         # Transform images for visualization
         if args.images:
-          fake_A, fake_B, *_ = keras_model(few_samples)
+          fake_A, fake_B, *_ = model_layer(few_samples)
           fake_A_viz = image_unnormalize(fake_A)
           fake_B_viz = image_unnormalize(fake_B)
 
@@ -140,6 +188,9 @@ def train(args):
     # End epoch
     step_saver.new_epoch()
 
+  # Wait for the last checkpoint
+  saver.wait()
+
 
 def use(args):
   '''\
@@ -158,7 +209,7 @@ def use(args):
   model_checkpoint = os.path.join(model_path, 'model')
 
   # Define dataset
-  image_shape = (300, 300, 3)
+  image_shape = (256, 256, 3)
   test_dataset, test_size = data.load_pair(*args.datasets, 'test',
       shape=image_shape, batch=args.batch)
 
@@ -166,7 +217,7 @@ def use(args):
   keras_model, model_layer = models.define_model(image_shape)
 
   # Load
-  keras_model.load_weights(model_checkpoint)
+  CheckpointSaver(keras_model, model_checkpoint).load()
   print('> Weights loaded')
 
   raise NotImplementedError()
@@ -186,7 +237,7 @@ def debug(args):
   # Saving the Tensorboard graph without training
 
   # Model
-  image_shape = (300, 300, 3)
+  image_shape = (256, 256, 3)
   keras_model, model_layer = models.define_model(image_shape)
 
   keras_model.summary()
@@ -218,10 +269,7 @@ def _prepare_directories(model_name, resume=False):
   if not resume:
 
     # Existing?
-    existing = []
-    for d in dirs:
-      if os.path.exists(d):
-        existing.append(d)
+    existing = [d for d in dirs if os.path.exists(d)]
 
     # Confirm
     if existing:
@@ -236,8 +284,9 @@ def _prepare_directories(model_name, resume=False):
       os.makedirs(d)
 
   # Logs alwas use new directories (using increasing numbers)
-  i = 0
-  while os.path.exists(os.path.join(logs_path, str(i))): i += 1
+  with os.scandir(logs_path) as entries:
+    ids = [int(e.name) for e in entries if e.is_dir() and e.name.isdigit()]
+  i = max(ids) + 1 if ids else 0
   log_path = os.path.join(logs_path, str(i))
   os.mkdir(log_path)
 
@@ -285,6 +334,10 @@ def main():
       help='Number of batches to use for validation.')
   train_parser.add_argument('--no-images', dest='images', action='store_false',
       help='Disable image saving in TensorBoard.')
+  train_parser.add_argument('-p', '--profile', type=int, default=0,
+      help='Number of training steps to profile in TensorBoard.')
+  train_parser.add_argument('-m', '--mixed-precision', action='store_true',
+      help='Compute in float16 (variables and losses are still float32).')
 
   # Use op
   use_parser = op_parsers.add_parser('use',
@@ -296,6 +349,10 @@ def main():
 
   args = parser.parse_args()
 
+  # Precision
+  if getattr(args, 'mixed_precision', False):
+    tf.keras.mixed_precision.set_global_policy('mixed_float16')
+
   # Go
   if args.op == 'train':
     train(args)
@@ -1,6 +1,8 @@
 ''' Utilities '''
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 
 class CountersSaver:
@@ -64,15 +66,22 @@ class CountersSaver:
 
 
 class CheckpointSaver:
-  ''' Saves checkpoints '''
+  '''\
+  Saves checkpoints. Weights are copied from the model when saving, then
+  written to file in background, so that training can continue.
+  '''
 
   def __init__(self, model, path):
-    ''' Saves Keras model to path as checkpoint file.  '''
+    ''' Saves Keras model weights to path (with .npz extension). '''
 
-    self.path = path
+    self.path = path + '.npz'
     self.model = model
     self.score = float('-inf')
 
+    # Background writer
+    self._writer = ThreadPoolExecutor(max_workers=1)
+    self._pending = None
+
 
   def save(self, score=None):
     '''\
@@ -90,7 +99,35 @@ class CheckpointSaver:
       else:
         self.score = score
 
-    # Save
-    self.model.save_weights(self.path, overwrite=True, save_format='tf')
+    # Copy, then save in background
+    weights = self.model.get_weights()
+    self.wait()
+    self._pending = self._writer.submit(self._write, weights)
 
     return True
+
+
+  def load(self):
+    ''' Loads the saved weights in the model '''
+
+    self.wait()
+    with np.load(self.path) as saved:
+      weights = [saved['arr_' + str(i)] for i in range(len(saved.files))]
+    self.model.set_weights(weights)
+
+
+  def wait(self):
+    ''' Waits until the last save is written (its errors are raised here) '''
+
+    if self._pending:
+      self._pending.result()
+      self._pending = None
+
+
+  def _write(self, weights):
+    ''' Writes weights to file. An existing file is replaced atomically. '''
+
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, *weights)
+    os.replace(tmp_path, self.path)
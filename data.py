@@ -82,55 +82,138 @@ def _dataset_files(name, split):
   # Dataset info
   info_file = datasets[name]
   dataset_dir = os.path.dirname(info_file)
+
+  # Find the split and count the files (just scanning lines)
+  split_i = None
+  counts = [0, 0]
   with open(info_file) as dataset_info:
-    files = dataset_info.read().splitlines()
+    for i, line in enumerate(dataset_info):
+      line = line.rstrip('\n')
+      if split_i is None and not line:
+        split_i = i
+      elif line:
+        counts[split_i is not None] += 1
 
   # Split
-  for split_i in range(len(files)):
-    if len(files[split_i]) == 0:
-      break
+  lines = tf.data.TextLineDataset(info_file)
   if split == 'train':
-    files = files[:split_i]
+    lines = lines.take(split_i if split_i is not None else -1)
+    size = counts[0]
   elif split == 'test':
-    files = files[split_i+1:]
+    lines = lines.skip(split_i+1 if split_i is not None else sum(counts))
+    size = counts[1]
+  else:
+    size = sum(counts)
 
   # Paths
-  files = [os.path.join(dataset_dir, f) for f in files if f]
+  lines = lines.map(lambda f: tf.strings.regex_replace(f, '\r$', ''))
+  lines = lines.filter(lambda f: tf.strings.length(f) > 0)
+  files = lines.map(lambda f: tf.strings.join([
+      os.path.join(dataset_dir, ''), f]))
 
   # Dataset
-  return tf.data.Dataset.from_tensor_slices(files), len(files)
+  return files, size
 
 
-def decode_image(path, out_shape):
+def _read_image(path, out_shape):
   '''\
-  Decodes a single image from path and resize it to the given dimension.
+  Reads and decodes a single image from path. The image is resized, so that its
+  shorter side matches the largest output dimension (aspect ratio is
+  preserved). This is the expensive and deterministic part of decoding.
+  The decoding ratio is the largest that doesn't go below the output size.
 
   Args:
     path: image file path
     out_shape: desired shape of each image
   Returns:
-    An image Tensor
+    An uint8 image Tensor
   '''
 
   # Read
   img = tf.io.read_file(path)
-  img = tf.image.decode_jpeg(img, channels=out_shape[2])
 
-  # Square crop
-  shape = tf.shape(img)
-  square_size = tf.reduce_min(shape[:2])
-  img = tf.image.random_crop(img, [square_size, square_size, shape[2]])
+  # Decode. Large images are downscaled by the decoder itself (a cheaper IDCT)
+  ratios = (1, 2, 4, 8)
+  jpeg_size = tf.reduce_min(tf.image.extract_jpeg_shape(img)[:2])
+  ratio_i = tf.reduce_sum(tf.cast(
+      jpeg_size // ratios[1:] >= max(out_shape[:2]), tf.int32))
+  img = tf.switch_case(ratio_i, [
+      lambda r=r: tf.image.decode_jpeg(img, channels=out_shape[2], ratio=r)
+      for r in ratios])
+
+  # Resize the shorter side
+  shape = tf.cast(tf.shape(img)[:2], tf.float32)
+  scale = max(out_shape[:2]) / tf.reduce_min(shape)
+  img = tf.image.resize(img, tf.cast(tf.math.ceil(shape * scale), tf.int32))
+
+  return tf.cast(tf.round(img), tf.uint8)
+
+
+def _crop_image(img, out_shape):
+  '''\
+  Random square crop of an image returned by _read_image. The crop has the
+  largest output dimension as side, so that all crops can be batched.
+
+  Args:
+    img: image Tensor
+    out_shape: desired shape of each image
+  Returns:
+    An image Tensor
+  '''
+
+  square_size = max(out_shape[:2])
+  return tf.image.random_crop(img, [square_size, square_size, out_shape[2]])
+
+
+def _resize_images(images, out_shape):
+  '''\
+  Resizes square crops, as returned by _crop_image, to the given dimension.
+  Crops are returned unchanged if out_shape is a square.
+
+  Args:
+    images: an image or a batch of images
+    out_shape: desired shape of each image
+  Returns:
+    Images Tensor
+  '''
+
+  if out_shape[0] == out_shape[1]:
+    return images
+  return tf.image.resize(images, out_shape[:2])
+
+
+def _normalize_images(images):
+  '''\
+  Scales images from [0,255] to [-1,1], the input range of the model.
+  Images can be uint8 tensors.
+  '''
+
+  return tf.cast(images, tf.float32)/127.5 - 1
+
+
+def decode_image(path, out_shape):
+  '''\
+  Decodes a single image from path and resize it to the given dimension.
+
+  Args:
+    path: image file path
+    out_shape: desired shape of each image
+  Returns:
+    An image Tensor
+  '''
 
-  # Resize
-  img = tf.image.resize(img, out_shape[:2])
+  img = _read_image(path, out_shape)
+  img = _crop_image(tf.cast(img, tf.float32), out_shape)
+  img = _resize_images(img, out_shape)
 
   return img
 
 
-def load(name, split, shape=(300, 300, 3), batch=None, shuffle=True):
+def load(name, split, shape=(256, 256, 3), batch=None, shuffle=True,
+    cache=None, prefetch=True, input_context=None):
   '''\
   Returns a Dataset. The dataset is already transformed to create the input
-  pipeline.
+  pipeline: images are randomly cropped, flipped, and normalized in [-1,1].
 
   Args:
     name: a dataset name. ('classes' is a combined dataset for classification)
@@ -138,50 +221,98 @@ def load(name, split, shape=(300, 300, 3), batch=None, shuffle=True):
     shape: desired shape of each image
     batch: how many samples to return. If None, the entire dataset is returned.
     shuffle: set to false if shuffling is not necessary.
+    cache: directory where decoded images are cached. If None, decoded images
+      are kept in memory.
+    prefetch: set to false if the dataset is combined with others and then
+      prefetched.
+    input_context: a tf.distribute.InputContext. If given, this pipeline
+      only loads its own shard of files (batch should be per replica).
 
   Returns:
-    Tf Dataset, dataset size
+    Tf Dataset, dataset size (of this shard)
   '''
 
   # Is this a classification task? Just for development
   classification = (name == 'classes')
 
-  def load_image(path):
-    return decode_image(path, shape)
+  def on_images(function):
+    ''' Applies function to images only (labels are untouched) '''
+    if not classification:
+      return function
+    return lambda images, labels: (function(images), labels)
 
-  def load_labelled_image(path, label):
-    return decode_image(path, shape), label
+  read_image = on_images(lambda path: _read_image(path, shape))
+  augment_image = on_images(lambda img:
+      tf.image.random_flip_left_right(_crop_image(img, shape)))
+  prepare_images = on_images(lambda imgs:
+      _normalize_images(_resize_images(imgs, shape)))
 
   # Dataset of paths
   images, size = _dataset_files(name, split) \
       if not classification else _classification_dataset(split)
 
+  # Shard files among input pipelines
+  shard_name = ''
+  if input_context:
+    pipelines = input_context.num_input_pipelines
+    pipeline_id = input_context.input_pipeline_id
+    images = images.shard(pipelines, pipeline_id)
+    size = len(range(pipeline_id, size, pipelines))
+    shard_name = '_' + str(pipeline_id)
+
   # Select batch
   if not batch or batch < 1 or batch > size :
     batch = size
 
-  # Input pipeline
+  # Decode just once. Files are opened and decoded concurrently. Cached
+  #   images depend on the shape
+  cache_file = os.path.join(cache, '{}_{}_{}x{}{}'.format(
+      name, split, *shape[:2], shard_name)) if cache else ''
+  images = images.interleave(
+      lambda *element: tf.data.Dataset.from_tensors(element).map(read_image),
+      cycle_length=min(16, size),
+      num_parallel_calls=tf.data.experimental.AUTOTUNE)
+  images = images.cache(cache_file)
+
+  # Input pipeline. Images are uint8 until batched
   if shuffle: images = images.shuffle(min(size, 10000))
   images = images.repeat()
-  images = images.map(load_image \
-      if not classification else load_labelled_image,
+  images = images.map(augment_image,
       num_parallel_calls=tf.data.experimental.AUTOTUNE)
-  images = images.batch(batch)
-  images = images.prefetch(1)
+  images = images.batch(batch, drop_remainder=True)
+  images = images.map(prepare_images,
+      num_parallel_calls=tf.data.experimental.AUTOTUNE)
+  if prefetch: images = images.prefetch(tf.data.experimental.AUTOTUNE)
+
+  # Static optimizations. Samples are shuffled anyway: don't wait for slow
+  #   images
+  options = tf.data.Options()
+  options.experimental_deterministic = False
+  options.experimental_optimization.map_fusion = True
+  options.experimental_optimization.map_and_batch_fusion = True
+  options.experimental_optimization.parallel_batch = True
+  if input_context:
+    options.experimental_distribute.auto_shard_policy = \
+        tf.data.experimental.AutoShardPolicy.OFF  # Already sharded
+  images = images.with_options(options)
 
   return images, size
 
 
 def load_pair(name_A, name_B, split, **kwargs):
-  ''' Load a pair of datasets '''
+  ''' Load a pair of datasets. A single dataset returns pairs of batches. '''
 
-  dataset_A, size_A = load(name_A, split, **kwargs)
-  dataset_B, size_B = load(name_B, split, **kwargs)
+  dataset_A, size_A = load(name_A, split, prefetch=False, **kwargs)
+  dataset_B, size_B = load(name_B, split, prefetch=False, **kwargs)
 
   # Dataset size is average of the two
   size = int((size_A + size_B) / 2)
 
-  return tf.data.Dataset.zip((dataset_A, dataset_B)), size
+  # One prefetch for both
+  dataset = tf.data.Dataset.zip((dataset_A, dataset_B))
+  dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+  return dataset, size
 
 
 def load_few(name, split, shape, n):
@@ -195,7 +326,7 @@ def load_few(name, split, shape, n):
     shape: desired shape of each image
     n: number of images
   Returns:
-    Images as a 4D tensor
+    Images as a 4D tensor, normalized in [-1,1]
   '''
 
   # Decode paths
@@ -213,4 +344,4 @@ def load_few(name, split, shape, n):
 
   # Load all
   images = [decode_image(path, shape) for path in paths]
-  return tf.convert_to_tensor(images)
+  return _normalize_images(tf.convert_to_tensor(images))
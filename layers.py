@@ -163,60 +163,42 @@ def layerize(name, scope):
   return decorator
 
 
-class InstanceNormalization(BaseLayer):
+def _normalize_instances(inputs, eps=1e-4):
   '''\
-  Instance normalization substitutes Batch normalization in CycleGan paper.
-  From their original implementation, I see that the affine transformation
-  is not included, but I leave an option here.
-  '''
-
-  def __init__(self, affine=True, **kwargs):
-    '''\
-    If affine is true, each channel is transformed with a scalar affine
-    transformation (adding scale and offset parameters).
-    '''
-
-    # Super
-    BaseLayer.__init__(self, **kwargs)
-
-    # Store
-    self.layer_options = {
-        'affine': affine,
-      }
-
+  Normalizes each image and channel of a batch to zero mean and unit variance
+  (no affine transformation).
 
-  def build(self, input_shape):
+  Args:
+    inputs: a batch of 3d tesors (4d input)
+    eps: small constant added to the variance
+  Returns:
+    A batch of 3d tensors
+  '''
 
-    if self.layer_options['affine']:
-      scalars_shape = [1, 1, 1, input_shape[3]]
-      self.scale = self.add_weight(shape=scalars_shape, name='scale',
-          initializer=tf.random_normal_initializer(1, 0.02))
-      self.offset = self.add_weight(shape=scalars_shape, name='offset',
-          initializer=tf.zeros_initializer())
+  # Normalize in image width height dimensions
+  mean, var = tf.nn.moments(inputs, axes=[1,2], keepdims=True)
+  return (inputs - mean) / tf.sqrt(var + eps)
 
-    # Built
-    BaseLayer.build(self, input_shape)
 
+def _add_normalization_weights(layer, channels):
+  '''\
+  Adds to layer the weights of the affine transformation that follows
+  instance normalization: a scale and an offset for each channel.
 
-  def call(self, inputs):
-    '''\
-    Args:
-      inputs: a batch of 3d tesors (4d input)
-    Returns:
-      A batch of 3d tensors
-    '''
-
-    eps = 1e-4
-
-    # Normalize in image width height dimensions
-    mean, var = tf.nn.moments(inputs, axes=[1,2], keepdims=True)
-    inputs = (inputs - mean) / tf.sqrt(var + eps)
+  Args:
+    layer: the layer that owns the weights
+    channels: number of channels
+  Returns:
+    scale, offset
+  '''
 
-    # Affine transformation
-    if self.layer_options['affine']:
-      inputs = self.scale * inputs + self.offset
+  scalars_shape = [1, 1, 1, channels]
+  scale = layer.add_weight(shape=scalars_shape, name='scale',
+      initializer=tf.random_normal_initializer(1, 0.02))
+  offset = layer.add_weight(shape=scalars_shape, name='offset',
+      initializer=tf.zeros_initializer())
 
-    return inputs
+  return scale, offset
 
 
 class GeneralConvBlock(BaseLayer):
@@ -225,9 +207,15 @@ class GeneralConvBlock(BaseLayer):
   - optional padding
   - 2d convolution (no padding)
   - Instance normalization
-  - ReLU activation
+  - ReLU (or LeakyReLU) activation
+  All operations are computed in a single call(), instead of separate layers,
+  so that the compiler (XLA) can fuse them.
   '''
 
+  # Slope of LeakyReLU activations
+  leaky_slope = 0.2
+
+
   def __init__(self, filters, kernel_size, stride=1, pad='valid',
       activation=True, normalization=True, **kwargs):
     '''\
@@ -239,7 +227,8 @@ class GeneralConvBlock(BaseLayer):
       pad: Can be 'valid', 'same', or an int. 'same' is a zero padding, 'valid'
         means no padding, an int is the amount of reflection padding added at
         each dimension.
-      activation: if true, a ReLU activation is applied.
+      activation: if true, a ReLU activation is applied. If 'leaky', a
+        LeakyReLU with slope leaky_slope is applied.
       normalization: if true, performs instance normalization (on by default).
     '''
     
@@ -261,44 +250,65 @@ class GeneralConvBlock(BaseLayer):
     ''' Instantiations '''
 
     # Vars
-    stack = []
-    filters, kernel_size, stride, pad, activation, normalization = \
+    filters, kernel_size, pad, normalization = \
         [ self.layer_options[opt] for opt in ('filters', 'kernel_size',
-          'stride', 'pad', 'activation', 'normalization') ]
+          'pad', 'normalization') ]
 
     if isinstance(pad, str):
-      conv_pad, reflect_pad = pad, 0
+      self._conv_pad, self._reflect_pad = pad.upper(), 0
     elif isinstance(pad, int):
-      conv_pad, reflect_pad = 'valid', pad
+      self._conv_pad, self._reflect_pad = 'VALID', pad
     else:
       raise TypeError('Valid pad specification is int or str')
 
+    # Convolution
+    self.kernel = self.add_weight(name='kernel',
+        shape=[kernel_size, kernel_size, input_shape[3], filters],
+        initializer=tf.random_normal_initializer(0, 0.02),
+        regularizer=tf.keras.regularizers.l2(l=0.01))
+    self.bias = self.add_weight(name='bias', shape=[filters],
+        initializer=tf.zeros_initializer())
+
+    # Normalization
+    if normalization:
+      self.scale, self.offset = _add_normalization_weights(self, filters)
+
+    # Super
+    BaseLayer.build(self, input_shape)
+
+
+  def call(self, inputs):
+    '''\
+    Args:
+      inputs: a batch of 3d tesors (4d input)
+    Returns:
+      A batch of 3d tensors
+    '''
+
+    # Vars
+    stride, activation, normalization = [ self.layer_options[opt] \
+        for opt in ('stride', 'activation', 'normalization') ]
 
     # Padding
-    if reflect_pad:
-      stack.append( PadReflection(pad=reflect_pad) )
+    if self._reflect_pad:
+      inputs = pad_reflection(inputs, pad=self._reflect_pad)
 
     # Convolution
-    stack.append( layers.Conv2D( filters=filters, kernel_size=kernel_size,
-        strides=stride, padding=conv_pad,
-        kernel_initializer=tf.random_normal_initializer(0, 0.02),
-        bias_initializer=tf.zeros_initializer(),
-        kernel_regularizer=tf.keras.regularizers.l2(l=0.01),
-      ))
+    inputs = tf.nn.conv2d(inputs, self.kernel, strides=stride,
+        padding=self._conv_pad)
+    inputs = tf.nn.bias_add(inputs, self.bias)
 
     # Normalization
     if normalization:
-      stack.append( InstanceNormalization() )
+      inputs = self.scale * _normalize_instances(inputs) + self.offset
 
     # Activation
-    if activation:
-      stack.append( tf.keras.layers.ReLU() )
-
-    # Store
-    self.layers_stack = stack
+    if activation == 'leaky':
+      inputs = tf.nn.leaky_relu(inputs, alpha=self.leaky_slope)
+    elif activation:
+      inputs = tf.nn.relu(inputs)
 
-    # Super
-    BaseLayer.build(self, input_shape)
+    return inputs
 
 
 class GeneralConvTransposeBlock(BaseLayer):
@@ -307,6 +317,7 @@ class GeneralConvTransposeBlock(BaseLayer):
   - Transpose Convolution
   - Instance normalization
   - ReLU
+  As in GeneralConvBlock, all operations are computed in a single call().
   '''
 
   def __init__(self, filters, kernel_size, stride=2, **kwargs):
@@ -333,31 +344,51 @@ class GeneralConvTransposeBlock(BaseLayer):
     ''' Instantiations '''
 
     # Vars
-    stack = []
-    filters, kernel_size, stride = [ self.layer_options[opt] \
-        for opt in ('filters', 'kernel_size', 'stride') ]
-
-    # Convolution transpose
-    stack.append( layers.Conv2DTranspose( filters=filters,
-        kernel_size=kernel_size, strides=stride, padding='same',
-        kernel_initializer=tf.random_normal_initializer(0, 0.02),
-        bias_initializer=tf.zeros_initializer(),
-        kernel_regularizer=tf.keras.regularizers.l2(l=0.01),
-      ))
+    filters, kernel_size = [ self.layer_options[opt] \
+        for opt in ('filters', 'kernel_size') ]
 
-    # Normalization
-    stack.append( InstanceNormalization() )
-
-    # Activation
-    stack.append( tf.keras.layers.ReLU() )
+    # Convolution transpose (kernel maps output to input channels)
+    self.kernel = self.add_weight(name='kernel',
+        shape=[kernel_size, kernel_size, filters, input_shape[3]],
+        initializer=tf.random_normal_initializer(0, 0.02),
+        regularizer=tf.keras.regularizers.l2(l=0.01))
+    self.bias = self.add_weight(name='bias', shape=[filters],
+        initializer=tf.zeros_initializer())
 
-    # Store
-    self.layers_stack = stack
+    # Normalization
+    self.scale, self.offset = _add_normalization_weights(self, filters)
 
     # Super
     BaseLayer.build(self, input_shape)
 
 
+  def call(self, inputs):
+    '''\
+    Args:
+      inputs: a batch of 3d tesors (4d input)
+    Returns:
+      A batch of 3d tensors
+    '''
+
+    # Vars
+    filters, stride = [ self.layer_options[opt] \
+        for opt in ('filters', 'stride') ]
+
+    # Convolution transpose ('same' padding)
+    shape = tf.shape(inputs)
+    output_shape = tf.stack([shape[0], shape[1]*stride, shape[2]*stride,
+        filters])
+    inputs = tf.nn.conv2d_transpose(inputs, self.kernel, output_shape,
+        strides=stride, padding='SAME')
+    inputs = tf.nn.bias_add(inputs, self.bias)
+
+    # Normalization
+    inputs = self.scale * _normalize_instances(inputs) + self.offset
+
+    # Activation
+    return tf.nn.relu(inputs)
+
+
 class ResNetBlock(BaseLayer):
   '''\
   In CycleGAN, a residual block is composed of:
@@ -402,55 +433,6 @@ class ResNetBlock(BaseLayer):
     return out + inputs
 
 
-@layerize('ImagePreprocessing', globals())
-def image_preprocessing(inputs, out_size):
-  '''\
-  Initial preprocessing for a batch of images.
-  Random crop, flip, normalization.
-  Expects as input, when called, a batch of images (4D tensor).
-  NOTE: I couldn't use built-in Tf ops for images, due to a probable Tf bug.
-
-  Args:
-    inputs: a batch of images (4d input)
-    out_shape: (out_height, out_width) Image size after preprocessing.
-        out_shape must be smaller than input shape.
-  Returns:
-    A batch of images
-  '''
-
-  # Shapes
-  input_shape = tf.shape(inputs)
-  batch_size = input_shape[0]
-  in_size = input_shape[1:3]
-  images = inputs
-
-  # Random crop
-  with tf.name_scope('RandomCrop') as scope:
-    crop_shift = in_size - out_size
-    shift0 = tf.random.uniform([], minval=0, maxval=crop_shift[0],
-        dtype=tf.dtypes.int32, name='RandomU1')
-    shift1 = tf.random.uniform([], minval=0, maxval=crop_shift[1],
-        dtype=tf.dtypes.int32, name='RandomU2')
-    images = images[:, shift0:(shift0+out_size[0]),
-        shift1:(shift1+out_size[1]), :]  # same crop for all in batch
-    images = tf.ensure_shape(images, [None, out_size[0], out_size[1], None])
-
-  # Random flip
-  with tf.name_scope('RandomFlip') as scope:
-    flips = tf.random.uniform([batch_size], minval=0, maxval=2,
-        dtype=tf.dtypes.int32)
-    flips = tf.cast(tf.reshape(flips, (batch_size, 1, 1, 1)), # image selection
-        dtype=tf.dtypes.float32)
-    flipped_images = tf.reverse(images, axis=[2])             # flip all
-    images = flipped_images * flips + images * (1-flips)      # select
-
-  # Normalization
-  with tf.name_scope('Normalization') as scope:
-    images = images/127.5 - 1
-
-  return images
-
-
 @layerize('ReduceMean', globals())
 def reduce_mean(inputs):
   '''\
@@ -511,17 +493,13 @@ def generator_GAN_loss(inputs):
   The goal of the generator is to trick the discriminator on the generated
   images.
   Args:
-    inputs: a batch of logits, where the first half is for true
-      images, and the remaining are for generated images.
+    inputs: a batch of logits for generated images.
   Returns:
     a scalar loss
   '''
   
-  # Separate logits
-  true_logits, false_logits = tf.split(inputs, 2, axis=0)
-
   # Probabilities
-  false_prob = tf.math.sigmoid(false_logits)
+  false_prob = tf.math.sigmoid(inputs)
 
   # Mse
   mse = tf.reduce_mean( tf.math.squared_difference(false_prob, 1) )
@@ -22,9 +22,15 @@ def _set_model():
   model_metrics = [None, None, 'dA_loss', 'dB_loss', 'gAB_loss', 'gBA_loss',]
 
 
-def define_model(image_shape):
+def define_model(image_shape, batch_size=None):
   '''\
   Creates the model.
+  Args:
+    image_shape: shape of each input image
+    batch_size: fixed number of images in each input batch. A static shape
+      avoids retracing and allows a fully static compilation. In the scope of
+      a distribution strategy, this is the global batch size (keras divides
+      it among replicas).
   Returns:
     keras model, and model layer
   '''
@@ -33,8 +39,10 @@ def define_model(image_shape):
   model_layer = Model()
 
   # Inputs are two batches of images from both datasets
-  input_A = tf.keras.Input(shape=image_shape, name='Input_A')
-  input_B = tf.keras.Input(shape=image_shape, name='Input_B')
+  input_A = tf.keras.Input(shape=image_shape, batch_size=batch_size,
+      name='Input_A')
+  input_B = tf.keras.Input(shape=image_shape, batch_size=batch_size,
+      name='Input_B')
   inputs = (input_A, input_B)
 
   # Model from IO behaviour
@@ -70,14 +78,14 @@ class Tester:
   Tests the model.
   Args:
     model: keras model to evaluate
-    iterator: dataset iterator of the test set
+    strategy: distribution strategy of the model. If None, the current one.
   '''
 
-  def __init__(self, model, iterator):
+  def __init__(self, model, strategy=None):
 
     # Store
     self.model = model
-    self.iterator = iterator
+    self.strategy = strategy if strategy else tf.distribute.get_strategy()
 
     # Initialize metrics
     metrics_names = get_model_metrics(None)
@@ -101,11 +109,16 @@ class Tester:
 
 
   @tf.function
-  def step(self):
-    ''' One evaluation step '''
+  def step(self, inputs):
+    ''' One evaluation step, on a (distributed) batch from the test set '''
+
+    self.strategy.run(self._replica_step, args=(inputs,))
+
+
+  def _replica_step(self, inputs):
 
     # Compute
-    outputs = self.model(next(self.iterator))
+    outputs = self.model(inputs)
     metrics = get_model_metrics(outputs)
 
     # Accumulate
@@ -119,15 +132,16 @@ class CycleGAN_trainer:
   Args:
     cgan_model: CycleGAN keras model to train
     optimizer: a callable that creates an optimizer
-    iterator: dataset iterator returning a pair of batches of images.
+    strategy: distribution strategy of the model. If None, the current one.
+      Model, optimizers, and this object must be created in its scope.
   '''
 
-  def __init__(self, cgan_model, optimizer, iterator):
+  def __init__(self, cgan_model, optimizer, strategy=None):
 
     # Store
     self.cgan = cgan_model
     cgan_layer = cgan_model.get_layer('CycleGAN')
-    self.iterator = iterator
+    self.strategy = strategy if strategy else tf.distribute.get_strategy()
 
     # Also save the parameters
     self.params = {}
@@ -143,20 +157,41 @@ class CycleGAN_trainer:
     self.optimizers['gAB'] = optimizer()
     self.optimizers['gBA'] = optimizer()
 
+    # Loss scaling avoids underflows of float16 gradients (mixed precision)
+    policy = tf.keras.mixed_precision.global_policy()
+    self.loss_scaling = (policy.compute_dtype == 'float16')
+    if self.loss_scaling:
+      self.optimizers = { name:
+          tf.keras.mixed_precision.LossScaleOptimizer(self.optimizers[name])
+          for name in self.optimizers }
+
     # Training the discriminator from old samples (reducing mode variance)
     self.gradients_dA = Queue(40)
     self.gradients_dB = Queue(40)
 
+    # Compile the forward step for the input shapes of the model (per replica)
+    inputs_spec = tuple(tf.TensorSpec(model_input.shape, model_input.dtype)
+        for model_input in cgan_model.inputs)
+    self._compiled_forward = tf.function(self._replica_forward,
+        jit_compile=True, input_signature=(inputs_spec,))
+
 
-  def step(self):
-    ''' One training step for CycleGAN '''
+  def step(self, inputs):
+    '''\
+    One training step for CycleGAN, on a pair of batches of images
+    (distributed, if using a strategy with many replicas).
+    '''
 
     # Forward step. Compute gradients
-    outputs, *gradients = self._forward()
+    outputs, *gradients, overflows = self._forward(inputs)
     gradient_dA, gradient_dB, gradient_gAB, gradient_gBA = gradients
 
+    # Overflow with loss scaling: applied now (optimizers skip the update
+    #   and lower the scale), never buffered
+    if self.loss_scaling and overflows > 0:
+      pass
     # From old samples
-    if self.gradients_dA.full():
+    elif self.gradients_dA.full():
       old_gradient_dA = self.gradients_dA.get_nowait() # get
       old_gradient_dB = self.gradients_dB.get_nowait()
       self.gradients_dA.put_nowait(gradient_dA)        # put
@@ -175,26 +210,91 @@ class CycleGAN_trainer:
 
 
   @tf.function
-  def _forward(self):
+  def _forward(self, inputs):
+
+    # The compiled function is called from a plain one: the strategy would
+    #   bind its signature to the distributed inputs, otherwise
+    outputs, *gradients, overflows = self.strategy.run(
+        lambda replica_inputs: self._compiled_forward(replica_inputs),
+        args=(inputs,))
+
+    # Number of replicas with non-finite discriminators gradients
+    overflows = self.strategy.reduce(tf.distribute.ReduceOp.SUM, overflows,
+        axis=None)
+
+    return (outputs, *gradients, overflows)
+
+
+  def _replica_forward(self, inputs):
+
+    # Record operations in forward step. There's a tape for each gradient
+    #   computation: it only records what depends on its own parameters, and
+    #   it can release it after its backward pass.
+    with tf.GradientTape(watch_accessed_variables=False) as tape_d, \
+        tf.GradientTape(watch_accessed_variables=False) as tape_gAB, \
+        tf.GradientTape(watch_accessed_variables=False) as tape_gBA:
+      tape_d.watch(self.params['dA'] + self.params['dB'])
+      tape_gAB.watch(self.params['gAB'])
+      tape_gBA.watch(self.params['gBA'])
 
-    # Record operations in forward step
-    with tf.GradientTape(persistent=True) as tape:
-      outputs = self.cgan(next(self.iterator))
-      
-    # Parse losses
-    losses = get_model_metrics(outputs)
+      outputs = self.cgan(inputs)
+
+      # Parse losses. Gradients are summed across replicas
+      losses = get_model_metrics(outputs)
+      replicas = self.strategy.num_replicas_in_sync
+      losses = { name: self._scale_loss(name,
+          losses[name + '_loss'] / replicas) for name in self.params }
+
+      # Each discriminator loss only depends on its own discriminator, so
+      #   both are derived in a single backward pass. This is not true for
+      #   generators (because of the cycle losses).
+      discriminators_loss = losses['dA'] + losses['dB']
 
     # Compute gradients
-    gradient_dA = tape.gradient(losses['dA_loss'], self.params['dA'])
-    gradient_dB = tape.gradient(losses['dB_loss'], self.params['dB'])
-    gradient_gAB = tape.gradient(losses['gAB_loss'], self.params['gAB'])
-    gradient_gBA = tape.gradient(losses['gBA_loss'], self.params['gBA'])
+    gradient_dA, gradient_dB = tape_d.gradient(discriminators_loss,
+        [self.params['dA'], self.params['dB']])
+    gradient_gAB = tape_gAB.gradient(losses['gAB'], self.params['gAB'])
+    gradient_gBA = tape_gBA.gradient(losses['gBA'], self.params['gBA'])
+
+    # Unscale
+    gradient_dA = self._unscale_gradients('dA', gradient_dA)
+    gradient_dB = self._unscale_gradients('dB', gradient_dB)
+    gradient_gAB = self._unscale_gradients('gAB', gradient_gAB)
+    gradient_gBA = self._unscale_gradients('gBA', gradient_gBA)
+
+    # Non-finite discriminators gradients are not buffered
+    finite = tf.reduce_all([ tf.reduce_all(tf.math.is_finite(g)) \
+        for g in gradient_dA + gradient_dB ])
+    overflow = 1 - tf.cast(finite, tf.int32)
+
+    return (outputs, gradient_dA, gradient_dB, gradient_gAB, gradient_gBA,
+        overflow)
+
+
+  def _scale_loss(self, name, loss):
+    ''' Scales the loss of the model part name, if loss scaling is used '''
 
-    return outputs, gradient_dA, gradient_dB, gradient_gAB, gradient_gBA
+    if not self.loss_scaling:
+      return loss
+    return self.optimizers[name].get_scaled_loss(loss)
+
+
+  def _unscale_gradients(self, name, gradients):
+    ''' Inverse of _scale_loss for the gradients of the model part name '''
+
+    if not self.loss_scaling:
+      return gradients
+    return self.optimizers[name].get_unscaled_gradients(gradients)
 
 
   @tf.function
-  def _apply(self, gradient_dA, gradient_dB, gradient_gAB, gradient_gBA):
+  def _apply(self, *gradients):
+
+    self.strategy.run(self._replica_apply, args=gradients)
+
+
+  def _replica_apply(self, gradient_dA, gradient_dB, gradient_gAB,
+      gradient_gBA):
 
     # Step
     self.optimizers['dA'].apply_gradients(zip(gradient_dA, self.params['dA']))
@@ -23,7 +23,8 @@ from layers import *
 class CycleGAN(BaseLayer):
   '''\
   Full CycleGAN model.
-  Inputs are batch of images from both datasets.
+  Inputs are batch of images from both datasets, normalized in [-1,1]
+  (see data.load).
   '''
 
   # Cycle consistency loss multiplier
@@ -33,9 +34,6 @@ class CycleGAN(BaseLayer):
   def build(self, input_shape):
     ''' Defines the net. '''
 
-    # Preprocessing
-    self.preprocessing = ImagePreprocessing(out_size=(256,256))
-
     # Generators
     self.generator_AB = Generator(name='Generator_AB')
     self.generator_BA = Generator(name='Generator_BA')
@@ -44,12 +42,12 @@ class CycleGAN(BaseLayer):
     self.discriminator_A = Discriminator(name='Discriminator_A')
     self.discriminator_B = Discriminator(name='Discriminator_B')
 
-    # Losses
-    self.discriminator_GAN_loss = DiscriminatorGANLoss()
+    # Losses (always in float32, even with mixed precision)
+    self.discriminator_GAN_loss = DiscriminatorGANLoss(dtype='float32')
 
-    self.generator_GAN_loss = GeneratorGANLoss()
-    self.generator_cycle_loss = GeneratorCycleLoss()
-    self.generator_identity_loss = GeneratorIdentityLoss()
+    self.generator_GAN_loss = GeneratorGANLoss(dtype='float32')
+    self.generator_cycle_loss = GeneratorCycleLoss(dtype='float32')
+    self.generator_identity_loss = GeneratorIdentityLoss(dtype='float32')
 
     # Super
     BaseLayer.build(self, input_shape)
@@ -58,13 +56,9 @@ class CycleGAN(BaseLayer):
   def call(self, inputs):
     ''' Forward pass '''
 
-    # Separate inputs of the two domains
+    # Separate inputs of the two domains (already preprocessed)
     images_A, images_B = inputs
 
-    # Image preprocessing
-    images_A = self.preprocessing(images_A)
-    images_B = self.preprocessing(images_B)
-
     # Normal transform
     fake_B = self.generator_AB(images_A)
     fake_A = self.generator_BA(images_B)
@@ -72,13 +66,25 @@ class CycleGAN(BaseLayer):
     fake_A = tf.identity(fake_A, name='fake_A')
     fake_B = tf.identity(fake_B, name='fake_B')
 
-    # Decisions (logits)
-    all_for_A = tf.concat((images_A, fake_A), axis=0, name='all_A')
+    # Generators output float32. Discriminators inputs have the compute dtype
+    #   (float16 with mixed precision)
+    fake_A_in = tf.cast(fake_A, images_A.dtype)
+    fake_B_in = tf.cast(fake_B, images_B.dtype)
+
+    # Decisions (logits). Discriminators losses don't backpropagate to the
+    #   generators
+    all_for_A = tf.concat((images_A, tf.stop_gradient(fake_A_in)), axis=0,
+        name='all_A')
     decision_A = self.discriminator_A(all_for_A)
 
-    all_for_B = tf.concat((images_B, fake_B), axis=0, name='all_B')
+    all_for_B = tf.concat((images_B, tf.stop_gradient(fake_B_in)), axis=0,
+        name='all_B')
     decision_B = self.discriminator_B(all_for_B)
 
+    # Decisions on generated images, for the generators
+    fake_decision_A = self.discriminator_A(fake_A_in)
+    fake_decision_B = self.discriminator_B(fake_B_in)
+
     # Backward transforms
     cycled_B = self.generator_AB(fake_A)
     cycled_A = self.generator_BA(fake_B)
@@ -98,12 +104,12 @@ class CycleGAN(BaseLayer):
     k_cycle, k_id = self.k_cycle, self.k_cycle/2
 
     generator_AB_loss = (
-        self.generator_GAN_loss(decision_B) +
+        self.generator_GAN_loss(fake_decision_B) +
         self.generator_cycle_loss((images_A, cycled_A)) * k_cycle +
         self.generator_identity_loss((identities_B, images_B)) * k_id
       ) /2
     generator_BA_loss = (
-        self.generator_GAN_loss(decision_A) +
+        self.generator_GAN_loss(fake_decision_A) +
         self.generator_cycle_loss((images_B, cycled_B)) * k_cycle +
         self.generator_identity_loss((identities_A, images_A)) * k_id
       ) /2
@@ -128,14 +134,11 @@ class Debugging(BaseLayer):
   def build(self, input_shape):
     ''' Defines the net '''
 
-    # Preprocessing
-    self.preprocessing = ImagePreprocessing(out_size=(256,256))
-
     # Generators
     self.generator_BA = Generator(name='Generator_BA')
 
     # Losses
-    self.generator_identity_loss = GeneratorIdentityLoss()
+    self.generator_identity_loss = GeneratorIdentityLoss(dtype='float32')
 
     # Super
     BaseLayer.build(self, input_shape)
@@ -144,12 +147,9 @@ class Debugging(BaseLayer):
   def call(self, inputs):
     ''' Forward pass '''
 
-    # Separate inputs of the two domains
+    # Separate inputs of the two domains (already preprocessed)
     images_A, images_B = inputs
 
-    # Image preprocessing
-    images_A = self.preprocessing(images_A)
-
     # Normal transform
     fake_A = self.generator_BA(images_A)
 
@@ -173,9 +173,9 @@ class Discriminator(BaseLayer):
   Image discriminator in CycleGAN (PatchGAN).
   Each block is a 2d convolution, instance normalization, and LeakyReLU
   activation. The number of filter double each time, while the image size is
-  halved. The final output is a (sigmoid) map of classifications for
-  {true, false}. With a 256x256 image input, each pixel of the 16x16 output map
-  has 70x70 receptive field.
+  halved. All convolutions use reflection padding. The final output is a
+  (sigmoid) map of classifications for {true, false}. With a 256x256 image
+  input, each pixel of the 15x15 output map has 70x70 receptive field.
 
   From a batch of input images, returns scalar logits for binary
   classification.
@@ -186,13 +186,11 @@ class Discriminator(BaseLayer):
 
     # Parameters
     filters = 64
-    Activation = lambda: layers.LeakyReLU(0.2)
 
     # Input block
     self.layers_stack += [
-        layers.Conv2D(filters=filters, kernel_size=4, strides=2,
-          padding='same'),
-        Activation(),
+        GeneralConvBlock(filters=filters, kernel_size=4, stride=2,
+          pad=1, activation='leaky', normalization=False),
       ]
 
     # Other blocks
@@ -200,15 +198,14 @@ class Discriminator(BaseLayer):
 
       filters *= 2
       self.layers_stack += [
-          layers.Conv2D(filters=filters, kernel_size=4, strides=2,
-            padding='same'),
-          InstanceNormalization(),
-          Activation(),
+          GeneralConvBlock(filters=filters, kernel_size=4, stride=2,
+            pad=1, activation='leaky'),
         ]
 
     # Output block
     self.layers_stack += [
-        layers.Conv2D(filters=1, kernel_size=4, strides=1, padding='same'),
+        GeneralConvBlock(filters=1, kernel_size=4, stride=1, pad=1,
+          activation=False, normalization=False),
         lambda x: tf.identity(x, name='logits'),
       ]
 
@@ -233,8 +230,8 @@ class Generator(BaseLayer):
       self.layers_stack = [
 
           GeneralConvBlock( filters=64, kernel_size=7, stride=1, pad=3 ),
-          GeneralConvBlock( filters=128, kernel_size=3, stride=2, pad='same' ),
-          GeneralConvBlock( filters=256, kernel_size=3, stride=2, pad='same' ),
+          GeneralConvBlock( filters=128, kernel_size=3, stride=2, pad=1 ),
+          GeneralConvBlock( filters=256, kernel_size=3, stride=2, pad=1 ),
         ]
 
       # Super
@@ -268,7 +265,7 @@ class Generator(BaseLayer):
           GeneralConvTransposeBlock( filters=64, kernel_size=3, stride=2 ),
           GeneralConvBlock( filters=3, kernel_size=7, stride=1, pad=3,
               activation=False, normalization=False ),
-          tf.keras.activations.tanh,
+          layers.Activation('tanh', dtype='float32'),
         ]
 
       # Super